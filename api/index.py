@@ -1,106 +1,557 @@
 import os
-import json
+import logging
+import time
+import hashlib
+import stat
+import itertools
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from dotenv import load_dotenv
 
 load_dotenv() # Load environment variables from .env file
 
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'WARNING').upper())
+logger = logging.getLogger(__name__)
+
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
+import orjson
+import msgspec
 from flask_cors import CORS
 import firebase_admin
 from firebase_admin import credentials, firestore, auth
-from datetime import datetime
+from firebase_admin import _token_gen
+from datetime import datetime, timezone
+from cachetools import TTLCache
+from celery import Celery
+from celery.result import AsyncResult
+from google.api_core.exceptions import NotFound, FailedPrecondition
+from cachecontrol import CacheControl
+from cachecontrol.caches.file_cache import FileCache
+from google.auth.transport import requests as google_requests
 import requests
-
-app = Flask(__name__)
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Naive datetimes are written as UTC
+ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC
+
+def _json_default(obj):
+    # Firestore returns DatetimeWithNanoseconds, a datetime subclass orjson
+    # does not serialize natively
+    if isinstance(obj, datetime):
+        if obj.tzinfo is None:
+            obj = obj.replace(tzinfo=timezone.utc)
+        return obj.isoformat()
+    return str(obj)
+
+class OrjsonProvider(JSONProvider):
+    """Serializes JSON with orjson instead of the stdlib json module"""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_json_default, option=ORJSON_OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response, skipping the str round trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=_json_default, option=ORJSON_OPTIONS),
+                                        mimetype='application/json')
+
+class App(Flask):
+    json_provider_class = OrjsonProvider
+
+app = App(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
 
+def json_body():
+    """Request body parsed straight from the raw bytes with orjson, whatever the
+    Content-Type says. Empty, malformed or non-object bodies give {}."""
+    try:
+        data = orjson.loads(request.get_data())
+    except orjson.JSONDecodeError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+# Typed bodies for the write routes, decoded from the raw bytes in one pass
+class EventIn(msgspec.Struct):
+    title: str
+    category: str
+    location: str
+    max_people: int
+    event_date: str
+    event_time: str
+
+class ReviewIn(msgspec.Struct):
+    target_uid: str
+    rating: int
+    comment: str
+
+def decode_body(struct_type):
+    """Request body decoded into `struct_type`. Raises msgspec.DecodeError (or its
+    subclass ValidationError) on malformed JSON or missing/mistyped fields."""
+    # strict=False accepts numbers sent as strings (form values, prompt() input)
+    return msgspec.json.decode(request.get_data(), type=struct_type, strict=False)
+
+# Google's token signing certs are served with Cache-Control: max-age.
+# Keep them in an on-disk HTTP cache so every worker process (and a restarted
+# one) reuses the certs instead of re-fetching them on its first verification.
+# The certs decide which ID tokens are valid, so the directory must be ours
+# alone: anyone who can write to it can plant certs and forge tokens.
+CERT_CACHE_DIR = os.environ.get('FIREBASE_CERT_CACHE_DIR') or os.path.join(
+    tempfile.gettempdir(), f'firebase-certs-{os.getuid() if hasattr(os, "getuid") else "app"}')
+
+def private_cache_dir(path):
+    """Creates path as a 0700 directory if missing, then checks it's a real
+    directory owned by this process's user that nobody else can access"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise RuntimeError(f"{path} is not a directory")
+    if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+        raise RuntimeError(f"{path} is owned by another user")
+    if st.st_mode & 0o077:
+        raise RuntimeError(f"{path} is accessible to other users")
+    return path
+
+class FileCachedCertRequest(_token_gen.CertificateFetchRequest):
+    """The SDK's cert fetcher, with its cache-control session swapped for one
+    backed by a FileCache. Keeps the SDK's per-request timeout."""
+    def __init__(self, session, timeout_seconds=None):
+        self._session = session
+        self._delegate = google_requests.Request(session)
+        self._timeout_seconds = timeout_seconds
+
+def use_persistent_cert_cache():
+    try:
+        session = CacheControl(requests.Session(), cache=FileCache(private_cache_dir(CERT_CACHE_DIR)))
+        verifier = auth._get_client(None)._token_verifier
+        verifier.request = FileCachedCertRequest(session, verifier.request.timeout_seconds)
+    except Exception as e:
+        # Falls back to the SDK's in-memory cache
+        logger.warning("Cert cache setup failed: %s", e)
+
 # Initialize Firebase
+# Requests are spread over several Firestore clients, each with its own gRPC
+# channel, so concurrent workers don't queue behind one channel.
+FIRESTORE_POOL_SIZE = int(os.environ.get('FIRESTORE_POOL_SIZE', 4))
+
+# Fields the event list needs; members_info and kicked_users stay server-side
+EVENT_LIST_FIELDS = ['title', 'category', 'location', 'max_people', 'current_people', 'event_date',
+                     'event_time', 'created_at', 'creator_name', 'creator_uid', 'members']
+
+@lru_cache(maxsize=1)
+def init_firebase():
+    """Parses credentials and builds the pooled Firestore clients once per process"""
+    # A warm instance that re-imports this module already has the default app
+    if not firebase_admin._apps:
+        if os.environ.get('FIREBASE_CREDENTIALS'):
+            cred = credentials.Certificate(orjson.loads(os.environ.get('FIREBASE_CREDENTIALS')))
+        else:
+            cred = credentials.Certificate("serviceAccountKey.json")
+        firebase_admin.initialize_app(cred)
+    use_persistent_cert_cache()
+
+    default_app = firebase_admin.get_app()
+    clients = [firestore.client()]
+    for i in range(1, FIRESTORE_POOL_SIZE):
+        name = f'pool-{i}'
+        try:
+            pool_app = firebase_admin.get_app(name)
+        except ValueError:
+            pool_app = firebase_admin.initialize_app(default_app.credential, name=name)
+        clients.append(firestore.client(app=pool_app))
+
+    # Top-level collections and the /events list query, built once per client
+    # instead of in every handler
+    pool = []
+    for client in clients:
+        events = client.collection('events')
+        pool.append({
+            'db': client,
+            'users': client.collection('users'),
+            'events': events,
+            'events_by_time': events.select(EVENT_LIST_FIELDS)
+                                    .order_by('created_at', direction=firestore.Query.DESCENDING),
+            'reviews': client.collection('reviews'),
+            'direct_messages': client.collection('direct_messages'),
+        })
+    return pool
+
 firebase_init_error = None
 try:
-    if os.environ.get('FIREBASE_CREDENTIALS'):
-        cred = credentials.Certificate(json.loads(os.environ.get('FIREBASE_CREDENTIALS')))
-    else:
-        cred = credentials.Certificate("serviceAccountKey.json")
-    firebase_admin.initialize_app(cred)
-    db = firestore.client()
+    DB_POOL = init_firebase()
 except Exception as e:
     firebase_init_error = str(e)
-    print(f"Firebase Init Error: {e}")
-    db = None
+    logger.error("Firebase Init Error: %s", e)
+    DB_POOL = []
+
+# Each thread is assigned a pooled client round-robin on first use
+_db_local = threading.local()
+_db_counter = itertools.count()
+
+def _pooled():
+    refs = getattr(_db_local, 'refs', None)
+    if refs is None:
+        refs = _db_local.refs = DB_POOL[next(_db_counter) % len(DB_POOL)]
+    return refs
+
+def db():
+    return _pooled()['db']
+
+def users_col():
+    return _pooled()['users']
+
+def events_col():
+    return _pooled()['events']
+
+def events_by_time():
+    return _pooled()['events_by_time']
+
+def reviews_col():
+    return _pooled()['reviews']
+
+def dm_col():
+    return _pooled()['direct_messages']
 
 # --- MIDDLEWARE: Verify Token ---
+# Decoded ID tokens keyed by sha256(token) -> (exp, decoded_token).
+# Skips signature verification for clients reusing the same token. Entries
+# live at most 5 minutes so disabled accounts stop being accepted soon after.
+_TOKEN_CACHE = TTLCache(maxsize=10_000, ttl=300)
+_TOKEN_CACHE_LOCK = threading.Lock()
+
 def verify_token(req):
     """Checks for 'Authorization' header and verifies it with Firebase"""
     if firebase_init_error:
-        print(f"Auth Error: Backend failed to initialize - {firebase_init_error}")
+        logger.error("Auth Error: Backend failed to initialize - %s", firebase_init_error)
         return None
 
     token = req.headers.get('Authorization')
     if not token:
-        print("Auth Error: No Authorization header found")
+        logger.debug("Auth Error: No Authorization header found")
         return None
+
+    key = hashlib.sha256(token.encode()).digest()
+    with _TOKEN_CACHE_LOCK:
+        cached = _TOKEN_CACHE.get(key)
+    if cached:
+        exp, decoded_token = cached
+        if exp > time.time():
+            return decoded_token
+        # Token expired since it was cached
+        with _TOKEN_CACHE_LOCK:
+            _TOKEN_CACHE.pop(key, None)
+
     try:
-        decoded_token = auth.verify_id_token(token)
-        print(f"Auth Success: User {decoded_token['uid']}")
+        decoded_token = auth.verify_id_token(token, check_revoked=False)
+        logger.debug("Auth Success: User %s", decoded_token['uid'])
+        with _TOKEN_CACHE_LOCK:
+            _TOKEN_CACHE[key] = (decoded_token['exp'], decoded_token)
         return decoded_token
     except Exception as e:
-        print(f"Auth Error: Token verification failed - {e}")
+        logger.info("Auth Error: Token verification failed - %s", e)
         return None
 
+# --- HELPERS ---
+USER_BATCH_SIZE = 10
+
+def get_user_docs(uids):
+    """Fetches user profiles with batched reads, returns {uid: data} for existing docs.
+    Larger lists are split into batches that are fetched concurrently."""
+    if not uids:
+        return {}
+    client = db()
+    refs = [users_col().document(uid) for uid in uids]
+    batches = [refs[i:i + USER_BATCH_SIZE] for i in range(0, len(refs), USER_BATCH_SIZE)]
+    if len(batches) == 1:
+        snapshots = [client.get_all(refs)]
+    else:
+        snapshots = POOL.map(lambda batch: list(client.get_all(batch)), batches)
+    return {doc.id: doc.to_dict() for batch in snapshots for doc in batch if doc.exists}
+
+def profile_info(data, default_name='Unknown'):
+    """The name/title pair copied onto friend docs and event members_info"""
+    data = data or {}
+    return {'name': data.get('name', default_name), 'title': data.get('title', '')}
+
+# User docs by uid, reused across requests for a short while
+_USER_CACHE = TTLCache(maxsize=10_000, ttl=60)
+_USER_CACHE_LOCK = threading.Lock()
+
+def get_cached_user(uid):
+    """Returns the user's profile doc ({} if missing), read through a short-lived cache"""
+    with _USER_CACHE_LOCK:
+        cached = _USER_CACHE.get(uid)
+    if cached is not None:
+        return cached
+    data = users_col().document(uid).get().to_dict() or {}
+    with _USER_CACHE_LOCK:
+        _USER_CACHE[uid] = data
+    return data
+
+def invalidate_cached_users(*uids):
+    with _USER_CACHE_LOCK:
+        for uid in uids:
+            _USER_CACHE.pop(uid, None)
+
+def get_profile_info(uid, default_name='Unknown'):
+    return profile_info(get_cached_user(uid), default_name)
+
+# friend_uids is kept by the friend routes for their own lookups; it is never
+# returned by the public profile route or accepted from the profile POST
+PRIVATE_USER_FIELDS = ['friend_uids']
+
+def friend_uids_with(uid, profile, friend_uid):
+    """New friend_uids value after adding friend_uid.
+    Users who predate the field get it backfilled from their friends subcollection."""
+    if profile is not None and 'friend_uids' in profile:
+        return firestore.ArrayUnion([friend_uid])
+    existing = [doc.id for doc in users_col().document(uid).collection('friends').stream()]
+    return list(dict.fromkeys(existing + [friend_uid]))
+
+def get_page_args(default_limit=50, max_limit=100, min_limit=1):
+    """Reads the ?limit= and ?cursor= query params used for cursor pagination"""
+    try:
+        limit = int(request.args.get('limit', default_limit))
+    except ValueError:
+        limit = default_limit
+    return max(min_limit, min(limit, max_limit)), request.args.get('cursor')
+
+class InvalidCursor(ValueError):
+    """The ?cursor= doc no longer exists, so the page can't be resumed"""
+
+@app.errorhandler(InvalidCursor)
+def invalid_cursor(e):
+    return jsonify({"error": str(e)}), 400
+
+def fetch_page(query, collection_ref, limit, cursor=None):
+    """Runs one page of an ordered query, resuming after the doc id given as cursor.
+    Returns (items, next_cursor); next_cursor is None on the last page.
+    Raises InvalidCursor if the cursor doc is gone."""
+    if cursor:
+        cursor_doc = collection_ref.document(cursor).get()
+        if not cursor_doc.exists:
+            raise InvalidCursor(f"Cursor {cursor} no longer exists")
+        query = query.start_after(cursor_doc)
+    docs = list(query.limit(limit).stream())
+    items = []
+    for doc in docs:
+        data = doc.to_dict()
+        data['id'] = doc.id
+        items.append(data)
+    next_cursor = docs[-1].id if len(docs) == limit else None
+    return items, next_cursor
+
+# GETs whose data rarely changes: clients may reuse a response for a minute and
+# revalidate it with If-None-Match after that. Only responses without personal
+# data (member lists) may be stored by the CDN; profiles hold emails.
+PUBLIC_CACHE_CONTROL = 'public, max-age=60, stale-while-revalidate=120'
+PRIVATE_CACHE_CONTROL = 'private, max-age=60, stale-while-revalidate=120'
+
+def cacheable_json(payload, cache_control=PUBLIC_CACHE_CONTROL):
+    """JSON response with a content-hash ETag, answered with an empty 304 when
+    the client's If-None-Match already has it"""
+    response = jsonify(payload)
+    response.set_etag(hashlib.blake2b(response.get_data(), digest_size=8).hexdigest())
+    response.headers['Cache-Control'] = cache_control
+    return response.make_conditional(request)
+
+def page_in_memory(query, order_field, limit, cursor=None):
+    """fetch_page for an unindexed query: streams every match, orders it
+    newest first by order_field and slices out the page after cursor"""
+    items = []
+    for doc in query.stream():
+        data = doc.to_dict()
+        data['id'] = doc.id
+        items.append(data)
+    oldest = datetime.min.replace(tzinfo=timezone.utc)
+    items.sort(key=lambda item: item.get(order_field) or oldest, reverse=True)
+    start = 0
+    if cursor:
+        ids = [item['id'] for item in items]
+        if cursor not in ids:
+            raise InvalidCursor(f"Cursor {cursor} no longer exists")
+        start = ids.index(cursor) + 1
+    page = items[start:start + limit]
+    next_cursor = page[-1]['id'] if len(page) == limit and start + limit < len(items) else None
+    return page, next_cursor
+
+# --- BACKGROUND WRITES ---
+# With CELERY_BROKER_URL set, Firestore writes the response doesn't depend on
+# are queued for a worker (run `celery -A index.celery worker` from api/).
+# Without a broker the tasks run inline, as part of the request.
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL')
+celery = Celery('wd', broker=CELERY_BROKER_URL,
+                backend=os.environ.get('CELERY_RESULT_BACKEND', CELERY_BROKER_URL))
+celery.conf.task_always_eager = not CELERY_BROKER_URL
+celery.conf.task_eager_propagates = True
+# 202 when a write was queued, 201 when it already happened inline
+WRITE_STATUS = 201 if celery.conf.task_always_eager else 202
+
+@firestore.transactional
+def set_missing_fields(transaction, ref, defaults):
+    """Writes only the fields of defaults that the doc doesn't have yet"""
+    existing = ref.get(transaction=transaction).to_dict() or {}
+    missing = {k: v for k, v in defaults.items() if k not in existing}
+    if missing:
+        transaction.set(ref, missing, merge=True)
+
+@celery.task(name='create_user_doc')
+def create_user_doc(uid, profile):
+    # With a broker this can land after the user's first profile save, which
+    # must win over the signup defaults
+    set_missing_fields(db().transaction(), users_col().document(uid),
+                       {**profile, 'created_at': firestore.SERVER_TIMESTAMP})
+
+@celery.task(name='create_event_doc')
+def create_event_doc(event_id, event):
+    batch = db().batch()
+    batch.set(events_col().document(event_id), {**event, 'created_at': firestore.SERVER_TIMESTAMP})
+    # Marker that lets delete_event authorize the creator without reading the event
+    batch.set(users_col().document(event['creator_uid']).collection('created_events').document(event_id), {
+        'created_at': firestore.SERVER_TIMESTAMP
+    })
+    batch.commit()
+
+@celery.task(name='refresh_profile_copies')
+def refresh_profile_copies(uid):
+    """Rewrites every denormalized name/title copy of a user's profile"""
+    # Read fresh: a worker's user cache isn't invalidated by the web process
+    info = profile_info(users_col().document(uid).get().to_dict())
+    friend_refs = [
+        users_col().document(doc.id).collection('friends').document(uid)
+        for doc in users_col().document(uid).collection('friends').stream()
+    ]
+    event_refs = [doc.reference for doc in events_col().where('members', 'array_contains', uid).stream()]
+    # Other users' pending requests to this user carry a copy as well
+    sent_request_refs = [doc.reference for doc in
+                         db().collection_group('sent_requests').where('target_uid', '==', uid).stream()]
+
+    writes = ([(ref, info, True) for ref in friend_refs + sent_request_refs]
+              + [(ref, {f'members_info.{uid}': info}, False) for ref in event_refs])
+    # A batch holds at most 500 writes
+    for i in range(0, len(writes), 500):
+        batch = db().batch()
+        for ref, fields, merge in writes[i:i + 500]:
+            if merge:
+                batch.set(ref, fields, merge=True)
+            else:
+                batch.update(ref, fields)
+        batch.commit()
+
+@celery.task(name='backfill_members_info')
+def backfill_members_info(event_id, members_info):
+    """Stores display info for members of events that predate members_info"""
+    events_col().document(event_id).update({f'members_info.{uid}': info for uid, info in members_info.items()})
+
+# Each reviewed user's doc keeps rating_sum/rating_count, so the review summary
+# is a single doc read. Users reviewed before the counters existed get them
+# seeded from an aggregation the first time they change.
+RATING_FIELDS = ['rating_sum', 'rating_count']
+
+def aggregate_ratings(uid, transaction=None):
+    """(sum, count) of the ratings on uid's reviews, aggregated server-side"""
+    query = reviews_col().where('target_uid', '==', uid)
+    result = query.count(alias='count').sum('rating', alias='sum').get(transaction=transaction)
+    stats = {r.alias: r.value for r in result[0]}
+    return stats.get('sum') or 0, stats.get('count') or 0
+
+@firestore.transactional
+def add_review_with_totals(transaction, review_ref, review):
+    user_ref = users_col().document(review['target_uid'])
+    totals = user_ref.get(field_paths=RATING_FIELDS, transaction=transaction).to_dict() or {}
+    if 'rating_count' in totals:
+        rating_sum, rating_count = totals.get('rating_sum', 0), totals['rating_count']
+    else:
+        rating_sum, rating_count = aggregate_ratings(review['target_uid'], transaction)
+
+    transaction.create(review_ref, {**review, 'created_at': firestore.SERVER_TIMESTAMP})
+    transaction.set(user_ref, {'rating_sum': rating_sum + review['rating'],
+                               'rating_count': rating_count + 1}, merge=True)
+
+@celery.task(name='add_review_doc')
+def add_review_doc(review):
+    add_review_with_totals(db().transaction(), reviews_col().document(), review)
+
 # --- AUTH ROUTES ---
 RECAPTCHA_SECRET = os.environ.get("RECAPTCHA_SECRET")
+RECAPTCHA_VERIFY_URL = "https://www.google.com/recaptcha/api/siteverify"
+FIREBASE_API_KEY = os.environ.get("FIREBASE_API_KEY")
+VERIFY_PASSWORD_URL = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={FIREBASE_API_KEY}"
+
+# (connect, read) timeouts for calls to Google
+HTTP_TIMEOUT = (2, 5)
+
+# Shared session so calls to Google reuse keep-alive connections
+HTTP = requests.Session()
+HTTP.mount('https://', HTTPAdapter(pool_connections=20, pool_maxsize=100,
+                                   max_retries=Retry(total=2, backoff_factor=0.1)))
+
+# Worker threads for overlapping independent network calls
+POOL = ThreadPoolExecutor(max_workers=16)
 
 def verify_recaptcha(token):
     if not token:
-        print("DEBUG: No CAPTCHA token provided")
+        logger.debug("No CAPTCHA token provided")
         return False
     
     if not RECAPTCHA_SECRET:
-        print("DEBUG: RECAPTCHA_SECRET is missing! Make sure to set the environment variable.")
+        logger.error("RECAPTCHA_SECRET is missing! Make sure to set the environment variable.")
         return False
 
     payload = {'secret': RECAPTCHA_SECRET, 'response': token}
     try:
-        r = requests.post("https://www.google.com/recaptcha/api/siteverify", data=payload)
+        r = HTTP.post(RECAPTCHA_VERIFY_URL, data=payload, timeout=HTTP_TIMEOUT)
         result = r.json()
-        print(f"DEBUG: Recaptcha verification result: {result}")
-        return result.get("success", False)
+        if not result.get("success", False):
+            # Only the error codes; the full response echoes request data
+            logger.info("Recaptcha rejected: %s", result.get("error-codes"))
+            return False
+        return True
     except Exception as e:
-        print(f"DEBUG: Recaptcha request failed: {e}")
+        logger.warning("Recaptcha request failed: %s", e)
         return False
 
 @app.route('/auth/signup', methods=['POST'])
 def signup():
-    data = request.json
+    data = json_body()
     email = data.get('email')
     password = data.get('password')
     name = data.get('name')
     captcha_token = data.get('captcha_token')
 
+    if not captcha_token:
+        return jsonify({"error": "Invalid CAPTCHA"}), 400
+
+    # The CAPTCHA is checked before the account exists; creating it alongside
+    # would let bots without a valid CAPTCHA create (and keep) real accounts
     if not verify_recaptcha(captcha_token):
         return jsonify({"error": "Invalid CAPTCHA"}), 400
 
     try:
-        # Create user in Firebase
-        user = auth.create_user(
-            email=email,
-            password=password,
-            display_name=name
-        )
+        user = auth.create_user(email=email, password=password, display_name=name)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        # Create user document in Firestore while the custom token is generated
+        doc_future = POOL.submit(create_user_doc.delay, user.uid, {
+            'name': name,
+            'email': email,
+            'bio': '',
+            'title': ''
+        })
         # Generate custom token for client to sign in
         custom_token = auth.create_custom_token(user.uid)
-        
-        # Create user document in Firestore
+
         try:
-            db.collection('users').document(user.uid).set({
-                'name': name,
-                'email': email,
-                'created_at': datetime.now(),
-                'bio': '',
-                'title': ''
-            })
+            doc_future.result()
         except Exception as db_e:
-            print(f"Error creating user doc: {db_e}")
+            logger.error("Error creating user doc: %s", db_e)
             # Continue anyway, token is generated
             
         return jsonify({"token": custom_token.decode('utf-8')}), 201
@@ -109,26 +560,31 @@ def signup():
 
 @app.route('/auth/login', methods=['POST'])
 def login():
-    data = request.json
+    data = json_body()
     email = data.get('email')
     password = data.get('password')
     captcha_token = data.get('captcha_token')
 
+    if not captcha_token:
+        return jsonify({"error": "Invalid CAPTCHA"}), 400
+
+    # Checked before the password: every sign-in attempt counts towards
+    # Firebase's TOO_MANY_ATTEMPTS lockout, even one whose result is discarded
     if not verify_recaptcha(captcha_token):
         return jsonify({"error": "Invalid CAPTCHA"}), 400
 
     try:
-
-        API_KEY = os.environ.get("FIREBASE_API_KEY")
-        verify_password_url = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={API_KEY}"
         payload = {"email": email, "password": password, "returnSecureToken": True}
-        res = requests.post(verify_password_url, json=payload)
+        res = HTTP.post(VERIFY_PASSWORD_URL, json=payload, timeout=HTTP_TIMEOUT)
         
         if res.status_code != 200:
             return jsonify({"error": "Invalid email or password"}), 401
             
         user_info = res.json()
         uid = user_info['localId']
+        # Warm the profile cache in the background; the client's first
+        # protected calls after login read it
+        POOL.submit(get_cached_user, uid)
         custom_token = auth.create_custom_token(uid)
         return jsonify({"token": custom_token.decode('utf-8')}), 200
 
@@ -141,6 +597,12 @@ from flask import send_file
 def home():
     return send_file('../index.html')
 
+@app.route('/tasks/<task_id>', methods=['GET'])
+def get_task_status(task_id):
+    if celery.conf.task_always_eager:
+        return jsonify({"error": "Background tasks are not enabled"}), 404
+    return jsonify({"id": task_id, "state": AsyncResult(task_id, app=celery).state}), 200
+
 @app.route('/health', methods=['GET'])
 def health():
     if firebase_init_error:
@@ -194,21 +656,54 @@ MOCK_EVENTS = [
 ]
 
 # --- PUBLIC ROUTES ---
+# First page of /events by limit, absorbs bursts of identical reads
+_EVENTS_PAGE_CACHE = TTLCache(maxsize=256, ttl=5)
+_EVENTS_PAGE_CACHE_LOCK = threading.Lock()
+# Queued event writes that may not have landed yet. The first page isn't
+# cached while any are pending, or it would be cached without them. Entries
+# expire in case a result is never reported.
+_PENDING_EVENT_TASKS = TTLCache(maxsize=1024, ttl=30)
+
+def invalidate_events_cache(task=None):
+    with _EVENTS_PAGE_CACHE_LOCK:
+        _EVENTS_PAGE_CACHE.clear()
+        if task is not None and not task.ready():
+            _PENDING_EVENT_TASKS[task.id] = True
+
+def events_cache_usable():
+    with _EVENTS_PAGE_CACHE_LOCK:
+        pending = list(_PENDING_EVENT_TASKS)
+    if not pending:
+        return True
+    done = [task_id for task_id in pending if AsyncResult(task_id, app=celery).ready()]
+    with _EVENTS_PAGE_CACHE_LOCK:
+        for task_id in done:
+            _PENDING_EVENT_TASKS.pop(task_id, None)
+        return not _PENDING_EVENT_TASKS
+
 @app.route('/events', methods=['GET'])
 def get_events():
     if firebase_init_error:
         return jsonify({"error": f"Backend Init Failed: {firebase_init_error}"}), 500
     try:
-        events_ref = db.collection('events').order_by('created_at', direction=firestore.Query.DESCENDING)
-        docs = events_ref.stream()
-        events = []
-        for doc in docs:
-            data = doc.to_dict()
-            data['id'] = doc.id
-            events.append(data)
-        return jsonify(events), 200
+        limit, cursor = get_page_args()
+        use_cache = not cursor and events_cache_usable()
+        if use_cache:
+            with _EVENTS_PAGE_CACHE_LOCK:
+                cached = _EVENTS_PAGE_CACHE.get(limit)
+            if cached is not None:
+                return jsonify(cached), 200
+
+        events, next_cursor = fetch_page(events_by_time(), events_col(), limit, cursor)
+        page = {"events": events, "next_cursor": next_cursor}
+        if use_cache:
+            with _EVENTS_PAGE_CACHE_LOCK:
+                _EVENTS_PAGE_CACHE[limit] = page
+        return jsonify(page), 200
+    except InvalidCursor as e:
+        return invalid_cursor(e)
     except Exception as e:
-        print(f"Error fetching events: {e}")
+        logger.error("Error fetching events: %s", e)
         return jsonify({"error": str(e)}), 500
 
 # --- PROTECTED ROUTES ---
@@ -218,22 +713,107 @@ def create_event():
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
 
-    data = request.json
+    try:
+        data = decode_body(EventIn)
+    except msgspec.DecodeError as e:
+        return jsonify({"error": str(e)}), 400
+
     new_event = {
-        'title': data.get('title'),
-        'category': data.get('category'),
-        'location': data.get('location'),
-        'max_people': int(data.get('max_people')),
+        'title': data.title,
+        'category': data.category,
+        'location': data.location,
+        'max_people': data.max_people,
         'current_people': 1,
-        'event_date': data.get('event_date'),
-        'event_time': data.get('event_time'),
-        'created_at': datetime.now(),
+        'event_date': data.event_date,
+        'event_time': data.event_time,
         'creator_name': user.get('name', 'Unknown'), # Use name from token
         'creator_uid': user['uid'],
-        'members': [user['uid']]
+        'members': [user['uid']],
+        # Denormalized display info so member lists need no profile reads
+        'members_info': {user['uid']: get_profile_info(user['uid'], user.get('name', 'Unknown'))}
     }
-    db.collection('events').add(new_event)
-    return jsonify({"message": "Created"}), 201
+    # The ID is allocated client-side, so it can be returned before the write lands
+    event_id = events_col().document().id
+    task = create_event_doc.delay(event_id, new_event)
+    invalidate_events_cache(task)
+    return jsonify({"message": "Created", "id": event_id, "task_id": task.id}), WRITE_STATUS
+
+# Read-check-write flows run in transactions so concurrent requests can't
+# act on a stale snapshot (e.g. two joins pushing an event over capacity).
+# Each returns the (payload, status) pair for the response.
+@firestore.transactional
+def toggle_membership(transaction, event_ref, user, member_info):
+    event = event_ref.get(field_paths=['members', 'current_people', 'max_people', 'kicked_users'],
+                          transaction=transaction)
+    if not event.exists:
+        return {"error": "Not found"}, 404
+
+    event_data = event.to_dict()
+    members = event_data.get('members', [])
+    if user['uid'] in members:
+        # Unjoin
+        transaction.update(event_ref, {
+            'members': firestore.ArrayRemove([user['uid']]),
+            f"members_info.{user['uid']}": firestore.DELETE_FIELD,
+            'current_people': firestore.Increment(-1)
+        })
+        return {"status": "unjoined"}, 200
+
+    # Join
+    # Check capacity
+    current_people = event_data.get('current_people', 0)
+    max_people = int(event_data.get('max_people', 100)) # Default to 100 if missing
+    
+    if current_people >= max_people:
+        return {"error": "Event is full"}, 400
+
+    # Check if kicked
+    if user['uid'] in event_data.get('kicked_users', []):
+        return {"error": "You have been kicked from this event"}, 403
+
+    transaction.update(event_ref, {
+        'members': firestore.ArrayUnion([user['uid']]),
+        f"members_info.{user['uid']}": member_info,
+        'current_people': firestore.Increment(1)
+    })
+    return {"status": "joined"}, 200
+
+@firestore.transactional
+def check_delete(transaction, ref, uid, field):
+    """Deletes the doc at ref if its `field` holds uid. Used by delete_event's
+    fallback, which words the response itself, so this returns only the
+    status: 200 deleted, 403 owned by someone else, 404 missing."""
+    snap = ref.get(field_paths=[field], transaction=transaction)
+    if not snap.exists:
+        return 404
+    if snap.to_dict().get(field) != uid:
+        return 403
+    transaction.delete(ref)
+    return 200
+
+@firestore.transactional
+def kick_if_creator(transaction, event_ref, uid, target_uid):
+    event = event_ref.get(field_paths=['creator_uid', 'members'], transaction=transaction)
+    
+    if not event.exists:
+        return {"error": "Event not found"}, 404
+    
+    event_data = event.to_dict()
+    
+    # Only creator can kick
+    if event_data.get('creator_uid') != uid:
+        return {"error": "Permission denied"}, 403
+    
+    if target_uid not in event_data.get('members', []):
+        return {"error": "User not in event"}, 400
+
+    transaction.update(event_ref, {
+        'members': firestore.ArrayRemove([target_uid]),
+        f"members_info.{target_uid}": firestore.DELETE_FIELD,
+        'kicked_users': firestore.ArrayUnion([target_uid]),
+        'current_people': firestore.Increment(-1)
+    })
+    return {"status": "kicked"}, 200
 
 @app.route('/join', methods=['POST'])
 def join_event():
@@ -241,39 +821,13 @@ def join_event():
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
 
-    data = request.json
-    event_ref = db.collection('events').document(data.get('event_id'))
-    event = event_ref.get()
-
-    if event.exists:
-        event_data = event.to_dict()
-        members = event_data.get('members', [])
-        if user['uid'] in members:
-            # Unjoin
-            event_ref.update({
-                'members': firestore.ArrayRemove([user['uid']]),
-                'current_people': firestore.Increment(-1)
-            })
-            return jsonify({"status": "unjoined"}), 200
-        else:
-            # Join
-            # Check capacity
-            current_people = event_data.get('current_people', 0)
-            max_people = int(event_data.get('max_people', 100)) # Default to 100 if missing
-            
-            if current_people >= max_people:
-                return jsonify({"error": "Event is full"}), 400
-
-            # Check if kicked
-            if user['uid'] in event_data.get('kicked_users', []):
-                return jsonify({"error": "You have been kicked from this event"}), 403
-
-            event_ref.update({
-                'members': firestore.ArrayUnion([user['uid']]),
-                'current_people': firestore.Increment(1)
-            })
-            return jsonify({"status": "joined"}), 200
-    return jsonify({"error": "Not found"}), 404
+    data = json_body()
+    event_ref = events_col().document(data.get('event_id'))
+    # Looked up before the transaction so retries don't repeat it
+    member_info = get_profile_info(user['uid'], user.get('name', 'Unknown'))
+    payload, status = toggle_membership(db().transaction(), event_ref, user, member_info)
+    invalidate_events_cache()
+    return jsonify(payload), status
 
 @app.route('/events/<event_id>', methods=['DELETE'])
 def delete_event(event_id):
@@ -281,15 +835,25 @@ def delete_event(event_id):
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
         
-    event_ref = db.collection('events').document(event_id)
-    doc = event_ref.get()
-    
-    # Check if the requester is the creator
-    if doc.exists and doc.to_dict().get('creator_uid') == user['uid']:
-        event_ref.delete()
+    event_ref = events_col().document(event_id)
+
+    # Only the creator has a created_events marker for this event. Deleting it
+    # with an exists precondition fails the whole batch for anyone else.
+    batch = db().batch()
+    batch.delete(users_col().document(user['uid']).collection('created_events').document(event_id),
+                 option=db().write_option(exists=True))
+    batch.delete(event_ref)
+    try:
+        batch.commit()
+        invalidate_events_cache()
+        return jsonify({"message": "Deleted"}), 200
+    except NotFound:
+        # No marker: not the creator, or an event created before markers existed
+        status = check_delete(db().transaction(), event_ref, user['uid'], 'creator_uid')
+        if status != 200:
+            return jsonify({"error": "Permission denied"}), 403
+        invalidate_events_cache()
         return jsonify({"message": "Deleted"}), 200
-    
-    return jsonify({"error": "Permission denied"}), 403
 
 @app.route('/events/<event_id>/kick', methods=['POST'])
 def kick_member(event_id):
@@ -297,33 +861,15 @@ def kick_member(event_id):
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
     
-    data = request.json
+    data = json_body()
     target_uid = data.get('target_uid')
     if not target_uid:
         return jsonify({"error": "Target UID required"}), 400
 
-    event_ref = db.collection('events').document(event_id)
-    doc = event_ref.get()
-    
-    if not doc.exists:
-        return jsonify({"error": "Event not found"}), 404
-    
-    event_data = doc.to_dict()
-    
-    # Only creator can kick
-    if event_data.get('creator_uid') != user['uid']:
-        return jsonify({"error": "Permission denied"}), 403
-    
-    if target_uid not in event_data.get('members', []):
-        return jsonify({"error": "User not in event"}), 400
-
-    event_ref.update({
-        'members': firestore.ArrayRemove([target_uid]),
-        'kicked_users': firestore.ArrayUnion([target_uid]),
-        'current_people': firestore.Increment(-1)
-    })
-    
-    return jsonify({"status": "kicked"}), 200
+    event_ref = events_col().document(event_id)
+    payload, status = kick_if_creator(db().transaction(), event_ref, user['uid'], target_uid)
+    invalidate_events_cache()
+    return jsonify(payload), status
 
 @app.route('/events/<event_id>/unblock', methods=['POST'])
 def unblock_member(event_id):
@@ -331,13 +877,13 @@ def unblock_member(event_id):
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
     
-    data = request.json
+    data = json_body()
     target_uid = data.get('target_uid')
     if not target_uid:
         return jsonify({"error": "Target UID required"}), 400
 
-    event_ref = db.collection('events').document(event_id)
-    doc = event_ref.get()
+    event_ref = events_col().document(event_id)
+    doc = event_ref.get(field_paths=['creator_uid'])
     
     if not doc.exists:
         return jsonify({"error": "Event not found"}), 404
@@ -360,8 +906,8 @@ def get_blocked_users(event_id):
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
 
-    event_ref = db.collection('events').document(event_id)
-    doc = event_ref.get()
+    event_ref = events_col().document(event_id)
+    doc = event_ref.get(field_paths=['creator_uid', 'kicked_users'])
     
     if not doc.exists:
         return jsonify({"error": "Event not found"}), 404
@@ -374,11 +920,11 @@ def get_blocked_users(event_id):
         
     blocked_uids = event_data.get('kicked_users', [])
     blocked_users = []
+    profiles = get_user_docs(blocked_uids)
     
     for uid in blocked_uids:
-        user_doc = db.collection('users').document(uid).get()
-        if user_doc.exists:
-            user_data = user_doc.to_dict()
+        user_data = profiles.get(uid)
+        if user_data is not None:
             blocked_users.append({
                 'uid': uid,
                 'name': user_data.get('name', 'Unknown'),
@@ -390,26 +936,31 @@ def get_blocked_users(event_id):
 @app.route('/events/<event_id>/members', methods=['GET'])
 def get_event_members(event_id):
     try:
-        event_ref = db.collection('events').document(event_id)
+        event_ref = events_col().document(event_id)
         event = event_ref.get()
         
         if not event.exists:
             return jsonify({"error": "Event not found"}), 404
             
-        member_uids = event.to_dict().get('members', [])
+        event_data = event.to_dict()
+        member_uids = event_data.get('members', [])
+        members_info = event_data.get('members_info', {})
         members_data = []
         
-        # Batch fetch users would be better, but for now loop is fine for small scale
-        # Or use 'in' query if list is small (<10)
-        
         if not member_uids:
-             return jsonify([]), 200
-
-        # Fetch up to 10 members at a time or just loop (simple for now)
+             return cacheable_json([])
+
+        # Events created before members_info existed need a profile read,
+        # and get it stored so the next listing doesn't
+        profiles = get_user_docs([uid for uid in member_uids if uid not in members_info])
+        if profiles:
+            try:
+                backfill_members_info.delay(event_id, {uid: profile_info(data) for uid, data in profiles.items()})
+            except Exception as backfill_e:
+                logger.warning("Error backfilling members_info for %s: %s", event_id, backfill_e)
         for uid in member_uids:
-            user_doc = db.collection('users').document(uid).get()
-            if user_doc.exists:
-                user_data = user_doc.to_dict()
+            user_data = members_info.get(uid) or profiles.get(uid)
+            if user_data is not None:
                 members_data.append({
                     "uid": uid,
                     "name": user_data.get('name', 'Unknown User'),
@@ -422,9 +973,9 @@ def get_event_members(event_id):
                     "title": ""
                 })
                 
-        return jsonify(members_data), 200
+        return cacheable_json(members_data)
     except Exception as e:
-        print(f"Error fetching members: {e}")
+        logger.error("Error fetching members: %s", e)
         return jsonify({"error": str(e)}), 500
 
 # --- REVIEW ROUTES ---
@@ -434,25 +985,44 @@ def add_review():
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
 
-    data = request.json
-    target_uid = data.get('target_uid')
-    rating = data.get('rating')
-    comment = data.get('comment')
+    try:
+        data = decode_body(ReviewIn)
+    except msgspec.DecodeError as e:
+        return jsonify({"error": str(e)}), 400
 
-    if not all([target_uid, rating, comment]):
+    if not all([data.target_uid, data.rating, data.comment]):
         return jsonify({"error": "Missing fields"}), 400
 
     review = {
         'reviewer_uid': user['uid'],
         'reviewer_name': user.get('name', 'Anonymous'),
-        'target_uid': target_uid,
-        'rating': int(rating),
-        'comment': comment,
-        'created_at': datetime.now()
+        'target_uid': data.target_uid,
+        'rating': data.rating,
+        'comment': data.comment
     }
 
-    db.collection('reviews').add(review)
-    return jsonify({"message": "Review added"}), 201
+    task = add_review_doc.delay(review)
+    return jsonify({"message": "Review added", "task_id": task.id}), WRITE_STATUS
+
+@firestore.transactional
+def delete_review_with_totals(transaction, review_ref, uid):
+    """check_delete for reviews that also takes the rating back out of the
+    target's counters. Returns 200 deleted, 403 not the reviewer, 404 missing."""
+    snap = review_ref.get(field_paths=['reviewer_uid', 'target_uid', 'rating'], transaction=transaction)
+    if not snap.exists:
+        return 404
+    review = snap.to_dict()
+    if review.get('reviewer_uid') != uid:
+        return 403
+
+    user_ref = users_col().document(review['target_uid'])
+    totals = user_ref.get(field_paths=RATING_FIELDS, transaction=transaction).to_dict() or {}
+    transaction.delete(review_ref)
+    # Without counters there is nothing to adjust; they get seeded without this review
+    if 'rating_count' in totals:
+        transaction.update(user_ref, {'rating_sum': firestore.Increment(-review.get('rating', 0)),
+                                      'rating_count': firestore.Increment(-1)})
+    return 200
 
 @app.route('/reviews/<review_id>', methods=['DELETE'])
 def delete_review(review_id):
@@ -460,26 +1030,25 @@ def delete_review(review_id):
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
 
-    review_ref = db.collection('reviews').document(review_id)
-    doc = review_ref.get()
-
-    if doc.exists:
-        if doc.to_dict().get('reviewer_uid') == user['uid']:
-            review_ref.delete()
-            return jsonify({"message": "Review deleted"}), 200
-        else:
-            return jsonify({"error": "Permission denied"}), 403
-    
+    review_ref = reviews_col().document(review_id)
+    status = delete_review_with_totals(db().transaction(), review_ref, user['uid'])
+    if status == 200:
+        return jsonify({"message": "Review deleted"}), 200
+    if status == 403:
+        return jsonify({"error": "Permission denied"}), 403
     return jsonify({"error": "Not found"}), 404
 
 # --- USER PROFILE ROUTES ---
 @app.route('/users/<user_id>', methods=['GET'])
 def get_user_profile(user_id):
-    user_ref = db.collection('users').document(user_id)
+    user_ref = users_col().document(user_id)
     doc = user_ref.get()
     if doc.exists:
-        return jsonify(doc.to_dict()), 200
-    return jsonify({}), 200 # Return empty if not found (first time)
+        data = doc.to_dict()
+        for field in PRIVATE_USER_FIELDS:
+            data.pop(field, None)
+        return cacheable_json(data, PRIVATE_CACHE_CONTROL)
+    return cacheable_json({}, PRIVATE_CACHE_CONTROL) # Return empty if not found (first time)
 
 @app.route('/users/profile', methods=['POST'])
 def update_user_profile():
@@ -487,10 +1056,18 @@ def update_user_profile():
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
     
-    data = request.json
+    data = json_body()
+    # Friend lists and rating counters are maintained by their own routes only
+    for field in PRIVATE_USER_FIELDS + RATING_FIELDS:
+        data.pop(field, None)
     # Merge with existing data
-    user_ref = db.collection('users').document(user['uid'])
+    user_ref = users_col().document(user['uid'])
     user_ref.set(data, merge=True)
+    invalidate_cached_users(user['uid'])
+
+    # Refresh the denormalized copies on friends' docs and joined events
+    if 'name' in data or 'title' in data:
+        refresh_profile_copies.delay(user['uid'])
     
     return jsonify({"message": "Profile updated"}), 200
 
@@ -501,26 +1078,36 @@ def send_friend_request():
     user = verify_token(request)
     if not user: return jsonify({"error": "Unauthorized"}), 401
     
-    data = request.json
+    data = json_body()
     target_uid = data.get('target_uid')
     if not target_uid: return jsonify({"error": "Target UID required"}), 400
     
-    # Check if already friends
-    if db.collection('users').document(user['uid']).collection('friends').document(target_uid).get().exists:
+    # Check if already friends. The cached friend_uids clears the usual case
+    # without a read; a hit is confirmed against the friends subcollection,
+    # since another process may have handled a removal the cache hasn't seen.
+    me = get_cached_user(user['uid'])
+    if 'friend_uids' in me and target_uid not in me['friend_uids']:
+        already_friends = False
+    else:
+        already_friends = users_col().document(user['uid']).collection('friends').document(target_uid).get().exists
+    if already_friends:
         return jsonify({"error": "Already friends"}), 400
 
+    batch = db().batch()
     # Add to target's friend_requests
-    db.collection('users').document(target_uid).collection('friend_requests').document(user['uid']).set({
+    batch.set(users_col().document(target_uid).collection('friend_requests').document(user['uid']), {
         'sender_uid': user['uid'],
         'sender_name': user.get('name', 'Unknown'),
-        'timestamp': datetime.now().isoformat()
+        'timestamp': firestore.SERVER_TIMESTAMP
     })
     
-    # Add to my sent_requests
-    db.collection('users').document(user['uid']).collection('sent_requests').document(target_uid).set({
+    # Add to my sent_requests, with the target's display info
+    batch.set(users_col().document(user['uid']).collection('sent_requests').document(target_uid), {
         'target_uid': target_uid,
-        'timestamp': datetime.now().isoformat()
+        **get_profile_info(target_uid),
+        'timestamp': firestore.SERVER_TIMESTAMP
     })
+    batch.commit()
     
     return jsonify({"message": "Request sent"}), 200
 
@@ -529,25 +1116,41 @@ def accept_friend_request():
     user = verify_token(request)
     if not user: return jsonify({"error": "Unauthorized"}), 401
     
-    data = request.json
+    data = json_body()
     requester_uid = data.get('requester_uid')
     if not requester_uid: return jsonify({"error": "Requester UID required"}), 400
     
+    # Friend docs carry the other user's display info
+    profiles = get_user_docs([user['uid'], requester_uid])
+
+    # All writes go out in one atomic commit
+    batch = db().batch()
+
     # 1. Add to my friends
-    db.collection('users').document(user['uid']).collection('friends').document(requester_uid).set({
-        'added_at': datetime.now().isoformat()
+    batch.set(users_col().document(user['uid']).collection('friends').document(requester_uid), {
+        'uid': requester_uid,
+        **profile_info(profiles.get(requester_uid)),
+        'added_at': firestore.SERVER_TIMESTAMP
     })
     
     # 2. Add me to their friends
-    db.collection('users').document(requester_uid).collection('friends').document(user['uid']).set({
-        'added_at': datetime.now().isoformat()
+    batch.set(users_col().document(requester_uid).collection('friends').document(user['uid']), {
+        'uid': user['uid'],
+        **profile_info(profiles.get(user['uid']), user.get('name', 'Unknown')),
+        'added_at': firestore.SERVER_TIMESTAMP
     })
     
     # 3. Delete request
-    db.collection('users').document(user['uid']).collection('friend_requests').document(requester_uid).delete()
+    batch.delete(users_col().document(user['uid']).collection('friend_requests').document(requester_uid))
     
     # 4. Delete sent_request from requester
-    db.collection('users').document(requester_uid).collection('sent_requests').document(user['uid']).delete()
+    batch.delete(users_col().document(requester_uid).collection('sent_requests').document(user['uid']))
+
+    # 5. Keep both users' friend_uids in step
+    for uid, other_uid in ((user['uid'], requester_uid), (requester_uid, user['uid'])):
+        batch.set(users_col().document(uid), {'friend_uids': friend_uids_with(uid, profiles.get(uid), other_uid)}, merge=True)
+    batch.commit()
+    invalidate_cached_users(user['uid'], requester_uid)
     
     return jsonify({"message": "Friend accepted"}), 200
 
@@ -556,12 +1159,14 @@ def reject_friend_request():
     user = verify_token(request)
     if not user: return jsonify({"error": "Unauthorized"}), 401
     
-    data = request.json
+    data = json_body()
     requester_uid = data.get('requester_uid')
     
-    db.collection('users').document(user['uid']).collection('friend_requests').document(requester_uid).delete()
+    batch = db().batch()
+    batch.delete(users_col().document(user['uid']).collection('friend_requests').document(requester_uid))
     # Also delete sent_request from requester
-    db.collection('users').document(requester_uid).collection('sent_requests').document(user['uid']).delete()
+    batch.delete(users_col().document(requester_uid).collection('sent_requests').document(user['uid']))
+    batch.commit()
     
     return jsonify({"message": "Request rejected"}), 200
 
@@ -570,13 +1175,15 @@ def cancel_friend_request():
     user = verify_token(request)
     if not user: return jsonify({"error": "Unauthorized"}), 401
     
-    data = request.json
+    data = json_body()
     target_uid = data.get('target_uid')
     
+    batch = db().batch()
     # Delete from my sent_requests
-    db.collection('users').document(user['uid']).collection('sent_requests').document(target_uid).delete()
+    batch.delete(users_col().document(user['uid']).collection('sent_requests').document(target_uid))
     # Delete from target's friend_requests
-    db.collection('users').document(target_uid).collection('friend_requests').document(user['uid']).delete()
+    batch.delete(users_col().document(target_uid).collection('friend_requests').document(user['uid']))
+    batch.commit()
     
     return jsonify({"message": "Request cancelled"}), 200
 
@@ -585,7 +1192,7 @@ def get_friend_requests():
     user = verify_token(request)
     if not user: return jsonify({"error": "Unauthorized"}), 401
     
-    reqs_ref = db.collection('users').document(user['uid']).collection('friend_requests').stream()
+    reqs_ref = users_col().document(user['uid']).collection('friend_requests').stream()
     requests = []
     for doc in reqs_ref:
         requests.append(doc.to_dict())
@@ -597,17 +1204,16 @@ def get_sent_requests():
     user = verify_token(request)
     if not user: return jsonify({"error": "Unauthorized"}), 401
     
-    sent_ref = db.collection('users').document(user['uid']).collection('sent_requests').stream()
+    sent_ref = users_col().document(user['uid']).collection('sent_requests').stream()
+    sent_docs = [doc.to_dict() for doc in sent_ref]
     sent_requests = []
     
-    for doc in sent_ref:
-        data = doc.to_dict()
-        target_uid = data.get('target_uid')
-        
-        # Fetch target profile for display
-        target_doc = db.collection('users').document(target_uid).get()
-        if target_doc.exists:
-            target_data = target_doc.to_dict()
+    # Requests sent before display info was stored need a profile read
+    profiles = get_user_docs([d.get('target_uid') for d in sent_docs if 'name' not in d])
+    for sent in sent_docs:
+        target_uid = sent.get('target_uid')
+        target_data = sent if 'name' in sent else profiles.get(target_uid)
+        if target_data is not None:
             sent_requests.append({
                 'target_uid': target_uid,
                 'name': target_data.get('name', 'Unknown'),
@@ -622,8 +1228,16 @@ def remove_friend(friend_uid):
     if not user: return jsonify({"error": "Unauthorized"}), 401
     
     # Remove from both sides
-    db.collection('users').document(user['uid']).collection('friends').document(friend_uid).delete()
-    db.collection('users').document(friend_uid).collection('friends').document(user['uid']).delete()
+    batch = db().batch()
+    batch.delete(users_col().document(user['uid']).collection('friends').document(friend_uid))
+    batch.delete(users_col().document(friend_uid).collection('friends').document(user['uid']))
+    # Only touch friend_uids where it exists, so it is never left half-populated
+    profiles = get_user_docs([user['uid'], friend_uid])
+    for uid, other_uid in ((user['uid'], friend_uid), (friend_uid, user['uid'])):
+        if 'friend_uids' in profiles.get(uid, {}):
+            batch.update(users_col().document(uid), {'friend_uids': firestore.ArrayRemove([other_uid])})
+    batch.commit()
+    invalidate_cached_users(user['uid'], friend_uid)
     
     return jsonify({"message": "Friend removed"}), 200
 
@@ -632,95 +1246,128 @@ def get_friends():
     user = verify_token(request)
     if not user: return jsonify({"error": "Unauthorized"}), 401
     
-    friends_ref = db.collection('users').document(user['uid']).collection('friends').stream()
+    friends_ref = users_col().document(user['uid']).collection('friends').stream()
+    friend_docs = {doc.id: doc.to_dict() for doc in friends_ref}
+    friend_uids = list(friend_docs)
     friends_list = []
     
-    for doc in friends_ref:
-        friend_uid = doc.id
-        # Fetch friend profile
-        friend_doc = db.collection('users').document(friend_uid).get()
-        if not friend_doc.exists: continue
-        
-        friend_data = friend_doc.to_dict()
-        
-        # Check activity (simple query for now)
-        # Find events where this friend is a member
-        events_ref = db.collection('events').where('members', 'array_contains', friend_uid).limit(1).stream()
-        active_event = None
-        for evt in events_ref:
-            active_event = evt.to_dict().get('title')
+    # Friend docs carry name/title; older ones need a profile read
+    profiles = {uid: d for uid, d in friend_docs.items() if 'name' in d}
+
+    # Check activity: find events where any friend is a member,
+    # 30 friends per query (array_contains_any limit). The queries are
+    # independent of each other and of the profile read, so the pool runs them
+    # while the profiles are read here.
+    chunks = [friend_uids[i:i + 30] for i in range(0, len(friend_uids), 30)]
+    event_futures = [
+        POOL.submit(lambda chunk: list(events_col().where('members', 'array_contains_any', chunk).stream()), chunk)
+        for chunk in chunks
+    ]
+    profiles.update(get_user_docs([uid for uid in friend_uids if uid not in profiles]))
+
+    active_events = {}
+    for chunk, future in zip(chunks, event_futures):
+        for evt in future.result():
+            evt_data = evt.to_dict()
+            for member_uid in evt_data.get('members', []):
+                if member_uid in chunk:
+                    active_events.setdefault(member_uid, evt_data.get('title'))
+
+    for friend_uid in friend_uids:
+        friend_data = profiles.get(friend_uid)
+        if friend_data is None: continue
             
         friends_list.append({
             'uid': friend_uid,
             'name': friend_data.get('name', 'Unknown'),
             'title': friend_data.get('title', ''),
-            'active_event': active_event
+            'active_event': active_events.get(friend_uid)
         })
         
     return jsonify(friends_list), 200
 
 @app.route('/reviews/<user_id>', methods=['GET'])
 def get_reviews(user_id):
-    reviews_ref = db.collection('reviews').where('target_uid', '==', user_id).stream()
-    
-    reviews = []
-    total_rating = 0
-    count = 0
+    reviews_query = reviews_col().where('target_uid', '==', user_id)
 
-    for doc in reviews_ref:
-        data = doc.to_dict()
-        data['id'] = doc.id
-        reviews.append(data)
-        total_rating += data.get('rating', 0)
-        count += 1
-
-    avg_rating = round(total_rating / count, 1) if count > 0 else 0
+    # Summary comes from the counters on the user doc, or an aggregation for
+    # users nobody has reviewed since the counters were introduced
+    totals = users_col().document(user_id).get(field_paths=RATING_FIELDS).to_dict() or {}
+    if 'rating_count' in totals:
+        rating_sum, count = totals.get('rating_sum', 0), totals['rating_count']
+    else:
+        rating_sum, count = aggregate_ratings(user_id)
+    avg_rating = round(rating_sum / count, 1) if count > 0 else 0
+
+    # Only one page of reviews is returned, newest first; ?limit=0 skips the
+    # listing for callers that only need the summary
+    limit, cursor = get_page_args(default_limit=20, min_limit=0)
+    reviews, next_cursor = [], None
+    if limit:
+        reviews_ref = reviews_query.order_by('created_at', direction=firestore.Query.DESCENDING)
+        try:
+            reviews, next_cursor = fetch_page(reviews_ref, reviews_col(), limit, cursor)
+        except FailedPrecondition as e:
+            # The (target_uid, created_at desc) index from firestore.indexes.json
+            # isn't deployed; page through the user's reviews in memory instead
+            logger.warning("Review index missing, sorting in memory: %s", e)
+            reviews, next_cursor = page_in_memory(reviews_query, 'created_at', limit, cursor)
 
     return jsonify({
         "reviews": reviews,
         "average_rating": avg_rating,
-        "total_reviews": count
+        "total_reviews": count,
+        "next_cursor": next_cursor
     }), 200
 
 # --- DIRECT MESSAGE ROUTES ---
+def fetch_messages(messages_col, limit, cursor):
+    """Newest page of a chat first, returned oldest-to-newest; next_cursor
+    walks back in time"""
+    messages_ref = messages_col.order_by('timestamp', direction=firestore.Query.DESCENDING)
+    # Messages with ISO-string timestamps from before SERVER_TIMESTAMP would
+    # sort above all others; backend/migrate_message_timestamps.py converts them
+    messages, next_cursor = fetch_page(messages_ref, messages_col, limit, cursor)
+    messages.reverse()
+    return messages, next_cursor
+
+def dm_chat_id(a, b):
+    """Deterministic chat ID for a pair of users, same for either order"""
+    return a + '_' + b if a < b else b + '_' + a
+
 @app.route('/friends/<friend_uid>/chat', methods=['GET'])
 def get_friend_messages(friend_uid):
     user = verify_token(request)
     if not user: return jsonify({"error": "Unauthorized"}), 401
     
-    # Deterministic Chat ID
-    chat_id = '_'.join(sorted([user['uid'], friend_uid]))
+    chat_id = dm_chat_id(user['uid'], friend_uid)
     
-    messages_ref = db.collection('direct_messages').document(chat_id).collection('messages').order_by('timestamp').stream()
-    messages = []
-    for doc in messages_ref:
-        data = doc.to_dict()
-        data['id'] = doc.id
-        messages.append(data)
+    limit, cursor = get_page_args()
+    messages, next_cursor = fetch_messages(dm_col().document(chat_id).collection('messages'), limit, cursor)
         
-    return jsonify(messages), 200
+    return jsonify({"messages": messages, "next_cursor": next_cursor}), 200
 
 @app.route('/friends/<friend_uid>/chat', methods=['POST'])
 def send_friend_message(friend_uid):
     user = verify_token(request)
     if not user: return jsonify({"error": "Unauthorized"}), 401
     
-    data = request.json
+    data = json_body()
     message = data.get('message')
     if not message: return jsonify({"error": "Message required"}), 400
     
-    # Deterministic Chat ID
-    chat_id = '_'.join(sorted([user['uid'], friend_uid]))
+    chat_id = dm_chat_id(user['uid'], friend_uid)
     
     msg_data = {
         'sender_uid': user['uid'],
         'sender_name': user.get('name', 'Anonymous'),
         'message': message,
-        'timestamp': datetime.now().isoformat()
+        'timestamp': firestore.SERVER_TIMESTAMP
     }
     
-    db.collection('direct_messages').document(chat_id).collection('messages').add(msg_data)
-    return jsonify(msg_data), 201
+    dm_col().document(chat_id).collection('messages').add(msg_data)
+    # Provisional timestamp for the response, the stored one is set by Firestore
+    return jsonify({**msg_data, 'timestamp': datetime.now(timezone.utc).isoformat()}), 201
 
 # --- CHAT ROUTES ---
 @app.route('/events/<event_id>/chat', methods=['GET'])
@@ -730,23 +1377,18 @@ def get_chat_messages(event_id):
         return jsonify({"error": "Unauthorized"}), 401
 
     # Verify membership
-    event_ref = db.collection('events').document(event_id)
-    event = event_ref.get()
+    event_ref = events_col().document(event_id)
+    event = event_ref.get(field_paths=['members', 'creator_uid'])
     if not event.exists:
         return jsonify({"error": "Event not found"}), 404
     
     if user['uid'] not in event.to_dict().get('members', []) and event.to_dict().get('creator_uid') != user['uid']:
         return jsonify({"error": "Not a member"}), 403
 
-    # Fetch messages
-    messages_ref = db.collection('events').document(event_id).collection('messages').order_by('timestamp').stream()
-    messages = []
-    for doc in messages_ref:
-        data = doc.to_dict()
-        data['id'] = doc.id
-        messages.append(data)
+    limit, cursor = get_page_args()
+    messages, next_cursor = fetch_messages(event_ref.collection('messages'), limit, cursor)
     
-    return jsonify(messages), 200
+    return jsonify({"messages": messages, "next_cursor": next_cursor}), 200
 
 @app.route('/events/<event_id>/chat', methods=['POST'])
 def send_chat_message(event_id):
@@ -755,15 +1397,15 @@ def send_chat_message(event_id):
         return jsonify({"error": "Unauthorized"}), 401
 
     # Verify membership
-    event_ref = db.collection('events').document(event_id)
-    event = event_ref.get()
+    event_ref = events_col().document(event_id)
+    event = event_ref.get(field_paths=['members', 'creator_uid'])
     if not event.exists:
         return jsonify({"error": "Event not found"}), 404
     
     if user['uid'] not in event.to_dict().get('members', []) and event.to_dict().get('creator_uid') != user['uid']:
         return jsonify({"error": "Not a member"}), 403
 
-    data = request.json
+    data = json_body()
     message = data.get('message')
     if not message:
         return jsonify({"error": "Message required"}), 400
@@ -772,11 +1414,15 @@ def send_chat_message(event_id):
         'sender_uid': user['uid'],
         'sender_name': user.get('name', 'Anonymous'),
         'message': message,
-        'timestamp': datetime.now().isoformat()
+        'timestamp': firestore.SERVER_TIMESTAMP
     }
 
-    db.collection('events').document(event_id).collection('messages').add(msg_data)
-    return jsonify(msg_data), 201
+    events_col().document(event_id).collection('messages').add(msg_data)
+    # Provisional timestamp for the response, the stored one is set by Firestore
+    return jsonify({**msg_data, 'timestamp': datetime.now(timezone.utc).isoformat()}), 201
 
 if __name__ == '__main__':
+    # Verbose logs for the local dev server unless LOG_LEVEL says otherwise
+    if 'LOG_LEVEL' not in os.environ:
+        logging.getLogger().setLevel(logging.DEBUG)
     app.run(debug=True, port=5001)
@@ -0,0 +1,52 @@
+from datetime import datetime, timezone
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+# Chat messages written before the API switched to SERVER_TIMESTAMP have
+# ISO-string timestamps. Firestore orders every string above every Timestamp,
+# so the newest-first chat pages show those before anything newer.
+# Run once (safe to re-run); strings written in the server's local time.
+
+# Initialize Firebase
+if not firebase_admin._apps:
+    cred = credentials.Certificate("serviceAccountKey.json")
+    firebase_admin.initialize_app(cred)
+
+db = firestore.client()
+
+# A WriteBatch holds at most 500 writes
+MAX_BATCH_WRITES = 500
+
+def chat_collections():
+    # list_documents() also yields DM chats that only exist as a subcollection
+    for parent in ('events', 'direct_messages'):
+        for doc_ref in db.collection(parent).list_documents():
+            yield doc_ref.collection('messages')
+
+converted = 0
+skipped = 0
+batch = db.batch()
+batch_writes = 0
+
+for messages in chat_collections():
+    # A range filter on a string only matches string values
+    for doc in messages.where('timestamp', '>=', '').stream():
+        value = doc.get('timestamp')
+        try:
+            timestamp = datetime.fromisoformat(value).astimezone(timezone.utc)
+        except ValueError:
+            print(f"Skipped {doc.reference.path}: unparseable timestamp {value!r}")
+            skipped += 1
+            continue
+        batch.update(doc.reference, {'timestamp': timestamp})
+        batch_writes += 1
+        converted += 1
+        if batch_writes >= MAX_BATCH_WRITES:
+            batch.commit()
+            batch = db.batch()
+            batch_writes = 0
+
+if batch_writes:
+    batch.commit()
+
+print(f"Converted {converted} message timestamps, skipped {skipped}")
@@ -1,6 +1,6 @@
+import json
 import firebase_admin
 from firebase_admin import credentials, firestore
-from datetime import datetime
 
 # Initialize Firebase
 if not firebase_admin._apps:
@@ -16,7 +16,7 @@ events = [
         'location': 'Rec Center Courts',
         'max_people': 6,
         'current_people': 4,
-        'created_at': datetime.now(),
+        'created_at': firestore.SERVER_TIMESTAMP,
         'creator_name': 'Felix Chen',
         'creator_uid': 'system_demo_user',
         'members': ['system_demo_user']
@@ -27,13 +27,32 @@ events = [
         'location': 'Library, Room 304',
         'max_people': 10,
         'current_people': 8,
-        'created_at': datetime.now(),
+        'created_at': firestore.SERVER_TIMESTAMP,
         'creator_name': 'Sarah Smith',
         'creator_uid': 'system_demo_user_2',
         'members': ['system_demo_user_2']
     }
 ]
 
+# Commit in batches: Firestore allows 500 writes and ~10 MiB per commit
+MAX_BATCH_WRITES = 500
+MAX_BATCH_BYTES = 9 * 1024 * 1024
+
+batch = db.batch()
+batch_writes = 0
+batch_bytes = 0
 for event in events:
-    db.collection('events').add(event)
+    event_size = len(json.dumps(event, default=str))
+    if batch_writes and (batch_writes >= MAX_BATCH_WRITES or batch_bytes + event_size > MAX_BATCH_BYTES):
+        batch.commit()
+        # A WriteBatch can only be committed once
+        batch = db.batch()
+        batch_writes = 0
+        batch_bytes = 0
+    batch.set(db.collection('events').document(), event)
+    batch_writes += 1
+    batch_bytes += event_size
     print(f"Added event: {event['title']}")
+
+if batch_writes:
+    batch.commit()
@@ -0,0 +1,22 @@
+import os
+import multiprocessing
+
+# Handlers spend nearly all their time waiting on Firestore and Google, so
+# each worker runs gevent and multiplexes many in-flight requests
+wsgi_app = 'index:app'
+chdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api')
+bind = f"0.0.0.0:{os.environ.get('PORT', '5001')}"
+
+worker_class = 'gevent'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_connections = 500
+timeout = 30
+
+def post_fork(server, worker):
+    # Firestore talks gRPC, which blocks the whole worker unless it runs on the
+    # gevent loop. Patch first so the order doesn't depend on gunicorn's worker
+    # init (patch_all is a no-op the second time).
+    from gevent import monkey
+    monkey.patch_all()
+    import grpc.experimental.gevent as grpc_gevent
+    grpc_gevent.init_gevent()